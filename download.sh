@@ -1,27 +1,335 @@
 #!/usr/bin/env bash
 
-if [ "$#" -ne 2 ]; then
-  echo "Usage: $0 <URL> <DESTINATION>"
+if [ "$#" -lt 2 ]; then
+  echo "Usage: $0 <URL> [URL...] <DESTINATION>"
   echo "   eg: $0 https://civitai.com/api/download/models/15236 /workspace/stable-diffusion-webui/models/Stable-diffusion"
   exit 1
 fi
 
-URL=${1}
-DESTINATION=${2}
+DESTINATION=${!#}
 USER_AGENT_STRING="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+MAX_PARALLEL=${MAX_PARALLEL:-4}
+MAX_RETRIES=5
+MAX_REDIRECTS=10
 
-if ! echo "${URL}" | grep -q "api"; then
+# Drop the trailing slash and sort the query parameters so that the
+# same download link written two different ways is only fetched once.
+canonical_url() {
+  local base=${1%%\?*}
+  base=${base%/}
+
+  if [[ "${1}" == *\?* ]]; then
+    echo "${base}?$(tr '&' '\n' <<< "${1#*\?}" | LC_ALL=C sort | paste -sd '&' -)"
+  else
+    echo "${base}"
+  fi
+}
+
+# Print the headers of the last response in a file written by
+# curl --dump-header, which holds every response that was received.
+last_response() {
+  if [ -f "${1}" ]; then
+    tr -d '\r' < "${1}" | awk '/^HTTP\//{b=""} {b=b $0 "\n"} END{printf "%s", b}'
+  fi
+}
+
+# Print the status code of the last response in a file written by
+# curl --dump-header.
+last_status() {
+  last_response "${1}" | grep '^HTTP/' | cut -d ' ' -f 2
+}
+
+# Print the value of the named header from the last response in a file
+# written by curl --dump-header.
+last_header() {
+  last_response "${1}" \
+    | grep -i "^${2}:" \
+    | tail -n 1 \
+    | sed 's/^[^:]*: *//'
+}
+
+# Print the absolute URL a Location header points to, resolving it
+# against the URL of the request when it is relative.
+resolve_location() {
+  local scheme=${1%%://*}
+  local host=${1#*://}
+  local path=${1%%\?*}
+  host=${host%%/*}
+  host=${host%%\?*}
+
+  case "${2}" in
+    *://*) echo "${2}" ;;
+    //*) echo "${scheme}:${2}" ;;
+    /*) echo "${scheme}://${host}${2}" ;;
+    *) echo "${path%/*}/${2}" ;;
+  esac
+}
+
+# Print the size of a file in bytes.
+file_size() {
+  wc -c < "${1}" | tr -d ' '
+}
+
+# Print the filename from a Content-Disposition header value, using
+# the plain filename= parameter if there is one and falling back to
+# the percent-encoded RFC 5987 filename*= parameter otherwise.
+disposition_filename() {
+  local name
+
+  name=$(sed -n 's/.*filename="\{0,1\}\([^";]*\).*/\1/p' <<< "${1}")
+
+  if [ -z "${name}" ]; then
+    name=$(sed -n "s/.*filename\*=[^']*'[^']*'\([^\";]*\).*/\1/p" <<< "${1}")
+    name=$(printf '%b' "${name//%/\\x}")
+  fi
+
+  name=${name##*/}
+
+  if [ "${name}" != "." ] && [ "${name}" != ".." ]; then
+    echo "${name}"
+  fi
+}
+
+URLS=()
+INVALID_URLS=()
+
+for URL in "${@:1:$#-1}"; do
+  if [[ "${URL}" != *api* ]]; then
+    INVALID_URLS+=("${URL}")
+    continue
+  fi
+
+  URL=$(canonical_url "${URL}")
+
+  for SEEN_URL in "${URLS[@]}"; do
+    if [ "${SEEN_URL}" = "${URL}" ]; then
+      continue 2
+    fi
+  done
+
+  URLS+=("${URL}")
+done
+
+# curl silently falls back to its default of 50 for --parallel-max
+# values above 300, so refuse them rather than ignore the setting.
+if ! [[ "${MAX_PARALLEL}" =~ ^[1-9][0-9]{0,2}$ ]] || [ "${MAX_PARALLEL}" -gt 300 ]; then
+  echo "ERROR: MAX_PARALLEL must be a number between 1 and 300, got: ${MAX_PARALLEL}"
+  exit 1
+fi
+
+if [ "${#INVALID_URLS[@]}" -gt 0 ]; then
+  for URL in "${INVALID_URLS[@]}"; do
+    echo "Invalid URL: ${URL}"
+  done
   echo "ERROR: Incorrect URL provided, you must provide the Download link from CivitAI, not the link to the model page."
   exit 1
 fi
 
-echo "Downloading model from ${URL}, please wait..."
+if [ "${#URLS[@]}" -eq 1 ]; then
+  echo "Downloading model from ${URLS[0]}, please wait..."
+else
+  echo "Downloading ${#URLS[@]} models, please wait..."
+fi
+
+cd "${DESTINATION}" || exit 1
+
+# Only show the progress meter when someone is watching it, otherwise
+# curl floods log files with carriage-return progress updates.
+PROGRESS_ARGS=()
+if [ ! -t 2 ]; then
+  PROGRESS_ARGS=(--no-progress-meter)
+fi
+
+# curl refuses to combine --continue-at with --remote-header-name, so
+# fetch a single byte of every download up front to learn the names
+# the server will use.  Doing this in one curl process with --next
+# lets all of the requests share the same connections, and --parallel
+# lets them run at the same time instead of one after the other.
+# --max-filesize stops a server that ignores the Range header from
+# sending the whole model just to tell us its name.
+#
+# curl applies --max-filesize to every response it follows with -L,
+# which would abort on any redirect that has a body, so redirects are
+# followed here one hop at a time instead.  The Location header is
+# still in the dumped headers when the body of a redirect is cut off,
+# so the size limit never gets in the way of following it.
+WORK_DIR=$(mktemp -d)
+trap 'rm -rf "${WORK_DIR}"' EXIT
+
+PROBE_URLS=("${URLS[@]}")
+PENDING=("${!URLS[@]}")
+
+for HOP in $(seq 0 "${MAX_REDIRECTS}"); do
+  PROBES=()
+
+  for i in "${PENDING[@]}"; do
+    if [ "${#PROBES[@]}" -gt 0 ]; then
+      PROBES+=(--next)
+    fi
+
+    PROBES+=(-r 0-0 --max-filesize 1 -D "${WORK_DIR}/${i}" -o /dev/null --retry "${MAX_RETRIES}" -A "${USER_AGENT_STRING}" "${PROBE_URLS[i]}")
+  done
+
+  # A (63) only means the size limit cut off a body that wasn't needed.
+  curl --parallel --parallel-max "${MAX_PARALLEL}" --no-progress-meter "${PROBES[@]}" 2> "${WORK_DIR}/errors"
+  grep -v '^curl: (63)' "${WORK_DIR}/errors" >&2
+
+  REDIRECTED=()
 
-cd ${DESTINATION}
+  for i in "${PENDING[@]}"; do
+    LOCATION=$(last_header "${WORK_DIR}/${i}" "location")
 
-if ! curl -JL --remote-name -A "${USER_AGENT_STRING}" "${URL}"; then
+    if [[ "$(last_status "${WORK_DIR}/${i}")" == 30[12378] ]] && [ -n "${LOCATION}" ]; then
+      PROBE_URLS[i]=$(resolve_location "${PROBE_URLS[i]}" "${LOCATION}")
+      REDIRECTED+=("${i}")
+    fi
+  done
+
+  if [ "${#REDIRECTED[@]}" -eq 0 ]; then
+    break
+  fi
+
+  PENDING=("${REDIRECTED[@]}")
+done
+
+# Check every response before anything is written to the destination,
+# so an error or a login page never ends up saved as a model file.
+TRANSFERS=()
+QUEUED_FILENAMES=()
+QUEUED_SIZES=()
+
+for i in "${!URLS[@]}"; do
+  URL=${URLS[i]}
+  STATUS=$(last_status "${WORK_DIR}/${i}")
+  CONTENT_TYPE=$(last_header "${WORK_DIR}/${i}" "content-type")
+  FILENAME=$(disposition_filename "$(last_header "${WORK_DIR}/${i}" "content-disposition")")
+
+  # The full size is after the slash in "Content-Range: bytes 0-0/<size>"
+  # for a ranged response, and the Content-Length of a complete one.
+  if [ "${STATUS}" = "206" ]; then
+    SIZE=$(last_header "${WORK_DIR}/${i}" "content-range")
+    SIZE=${SIZE##*/}
+  else
+    SIZE=$(last_header "${WORK_DIR}/${i}" "content-length")
+  fi
+
+  if ! [[ "${SIZE}" =~ ^[0-9]+$ ]]; then
+    SIZE=""
+  fi
+
+  if [ "${STATUS}" != "206" ] && [ "${STATUS}" != "200" ]; then
+    echo "ERROR: Download of ${URL} failed with HTTP status ${STATUS:-unknown}."
+    exit 1
+  fi
+
+  if [[ "${CONTENT_TYPE}" == *text/html* ]]; then
+    echo "ERROR: ${URL} returned a web page instead of a model file."
+    exit 1
+  fi
+
+  if [ -z "${FILENAME}" ]; then
+    echo "ERROR: Unable to determine the filename for ${URL}."
+    exit 1
+  fi
+
+  # Two transfers writing the same .part file at once would corrupt it.
+  for QUEUED_FILENAME in "${QUEUED_FILENAMES[@]}"; do
+    if [ "${QUEUED_FILENAME}" = "${FILENAME}" ]; then
+      echo "Skipping ${URL}, another URL is already downloading ${FILENAME}."
+      continue 2
+    fi
+  done
+
+  if [ -f "${FILENAME}" ]; then
+    echo "Skipping ${FILENAME}, it has already been downloaded."
+    continue
+  fi
+
+  # A .part file can already be complete if the script was interrupted
+  # before renaming it, and resuming it would only get a 416 back.  One
+  # larger than the model can't be resumed at all.
+  if [ -f "${FILENAME}.part" ] && [ -n "${SIZE}" ]; then
+    PART_SIZE=$(file_size "${FILENAME}.part")
+
+    if [ "${PART_SIZE}" -eq "${SIZE}" ]; then
+      mv -f -- "${FILENAME}.part" "${FILENAME}"
+      echo "Skipping ${FILENAME}, it has already been downloaded."
+      continue
+    fi
+
+    if [ "${PART_SIZE}" -gt "${SIZE}" ]; then
+      rm -f -- "${FILENAME}.part"
+    fi
+  fi
+
+  # A 200 instead of 206 means the server ignored the Range header, so
+  # a partial download cannot be resumed and has to start over.
+  RESUME_ARGS=(-C -)
+
+  if [ "${STATUS}" != "206" ]; then
+    rm -f -- "${FILENAME}.part"
+    RESUME_ARGS=()
+  fi
+
+  if [ "${#TRANSFERS[@]}" -gt 0 ]; then
+    TRANSFERS+=(--next)
+  fi
+
+  TRANSFERS+=(-L --fail "${RESUME_ARGS[@]}" --retry "${MAX_RETRIES}" -A "${USER_AGENT_STRING}" -o "${FILENAME}.part" "${URL}")
+  QUEUED_FILENAMES+=("${FILENAME}")
+  QUEUED_SIZES+=("${SIZE}")
+done
+
+if [ "${#TRANSFERS[@]}" -eq 0 ]; then
+  echo "Nothing to download."
+  exit 0
+fi
+
+# Models are downloaded into a .part file which is only renamed once
+# that transfer has completed, each in its own --next operation so the
+# resume option can be left off for servers that don't support it.
+curl --parallel --parallel-max "${MAX_PARALLEL}" "${PROGRESS_ARGS[@]}" "${TRANSFERS[@]}"
+CURL_STATUS=$?
+
+# A failed transfer in a --parallel batch doesn't say which one failed,
+# so a .part file is complete once it reaches the size reported by the
+# server, or when every transfer succeeded if the size is unknown.
+for i in "${!QUEUED_FILENAMES[@]}"; do
+  FILENAME=${QUEUED_FILENAMES[i]}
+  SIZE=${QUEUED_SIZES[i]}
+
+  if [ ! -f "${FILENAME}.part" ]; then
+    continue
+  fi
+
+  if { [ -n "${SIZE}" ] && [ "$(file_size "${FILENAME}.part")" = "${SIZE}" ]; } \
+    || { [ -z "${SIZE}" ] && [ "${CURL_STATUS}" -eq 0 ]; }; then
+    mv -f -- "${FILENAME}.part" "${FILENAME}"
+  fi
+done
+
+# curl can succeed without the model being complete, for example if
+# the server sent fewer bytes than it said the model has.
+INCOMPLETE=0
+
+for FILENAME in "${QUEUED_FILENAMES[@]}"; do
+  if [ ! -f "${FILENAME}" ]; then
+    echo "ERROR: ${FILENAME} was not downloaded completely, run the same command again to resume it."
+    INCOMPLETE=1
+  fi
+done
+
+if [ "${CURL_STATUS}" -ne 0 ]; then
   echo "ERROR: curl command failed. Unable to download the file."
   exit 1
 fi
 
-echo "Model downloaded successfully!"
+if [ "${INCOMPLETE}" -ne 0 ]; then
+  exit 1
+fi
+
+if [ "${#URLS[@]}" -eq 1 ]; then
+  echo "Model downloaded successfully!"
+else
+  echo "Models downloaded successfully!"
+fi